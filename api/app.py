@@ -1,9 +1,14 @@
+import time
+
+import metrics
 from config import settings
 from endpoints import file, fix, health
+from endpoints import metrics as metrics_endpoint
 from fastapi import APIRouter, Depends, FastAPI
 from fastapi.requests import Request
 from fastapi.responses import Response
 from loguru import logger
+from starlette.routing import Match
 
 APP = FastAPI(
     version=settings.APP_VERSION,
@@ -36,6 +41,11 @@ async def log_request(request: Request):
 @APP.middleware("http")
 async def log_response(request: Request, call_next):
     response = await call_next(request)
+
+    # skip dumping metrics body, it is scraped often and large
+    if request.url.path == APP.url_path_for("metrics:get_metrics"):
+        return response
+
     body = b""
     async for chunk in response.body_iterator:
         body += chunk
@@ -50,6 +60,34 @@ async def log_response(request: Request, call_next):
     )
 
 
+# Record request latency by matched route
+@APP.middleware("http")
+async def record_latency(request: Request, call_next):
+    route = "unmatched"
+    for candidate in request.app.routes:
+        match, _ = candidate.matches(request.scope)
+        if match == Match.FULL:
+            route = candidate.path
+            break
+
+    # unhandled errors are turned into 500 by the outer middleware,
+    # record them here before re-raising
+    start = time.perf_counter()
+    try:
+        response = await call_next(request)
+    except Exception:
+        metrics.REQUEST_LATENCY.labels(
+            method=request.method, route=route, status=500
+        ).observe(time.perf_counter() - start)
+        raise
+    metrics.REQUEST_LATENCY.labels(
+        method=request.method, route=route, status=response.status_code
+    ).observe(time.perf_counter() - start)
+
+    return response
+
+
 APP.include_router(
     ROUTER, prefix=settings.APP_PREFIX, dependencies=[Depends(log_request)]
 )
+APP.include_router(metrics_endpoint.router, prefix="/metrics", tags=["metrics"])
@@ -0,0 +1,473 @@
+"""
+Load and throughput benchmark for the storage API
+
+Every (NUM_DISKS, object size) pair runs in its own worker process, so the
+storage settings can be changed through environment variables and peak RSS
+is reported once per pair. A worker drives the ASGI `APP` in-process, or a
+uvicorn server started as a separate process with `--uvicorn`, through
+create, retrieve, update and delete at every concurrency level. Fix rebuilds
+a whole disk one request at a time, so it runs once per worker.
+
+In-process peak RSS includes the client, with `--uvicorn` it is measured on
+the server process only. Regressions are gated on ops/s, p50 latency and
+peak RSS; p99 is reported but too noisy at small sample counts to gate on.
+
+    cd api && python benchmark.py --sizes 1K,1M --concurrency 1,8 --disks 3,5
+    cd api && python benchmark.py --save-baseline benchmark-baseline.json
+    cd api && python benchmark.py --baseline benchmark-baseline.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from config import settings
+
+OPERATIONS: Tuple[str, ...] = ("create", "retrieve", "update", "fix", "delete")
+UNITS: Dict[str, int] = {"K": 1024, "M": 1024 * 1024, "G": 1024 * 1024 * 1024}
+MB: int = 1024 * 1024
+
+
+@dataclass
+class Result:
+    transport: str
+    disks: int
+    size: int
+    concurrency: int
+    operation: str
+    ops: int
+    ops_per_sec: float
+    mb_per_sec: float
+    p50_ms: float
+    p99_ms: float
+
+    @property
+    def key(self) -> Tuple[str, int, int, int, str]:
+        return (
+            self.transport,
+            self.disks,
+            self.size,
+            self.concurrency,
+            self.operation,
+        )
+
+
+@dataclass
+class Memory:
+    transport: str
+    disks: int
+    size: int
+    peak_rss_mb: float
+
+    @property
+    def key(self) -> Tuple[str, int, int]:
+        return (self.transport, self.disks, self.size)
+
+
+def parse_size(value: str) -> int:
+    value = value.strip().upper()
+    if value and value[-1] in UNITS:
+        return int(float(value[:-1]) * UNITS[value[-1]])
+    return int(value)
+
+
+def parse_list(value: str, parse: Callable[[str], int] = int) -> List[int]:
+    return [parse(item) for item in value.split(",") if item.strip()]
+
+
+def peak_rss_mb(who: int = resource.RUSAGE_SELF) -> float:
+    # ru_maxrss is reported in kilobytes on linux and bytes on macOS
+    rss = resource.getrusage(who).ru_maxrss
+    return rss / MB if sys.platform == "darwin" else rss / 1024
+
+
+def free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def wait_for_port(port: int, proc: subprocess.Popen, timeout: float = 30) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"server exited with status {proc.returncode}")
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=1):
+                return
+        except OSError:
+            await asyncio.sleep(0.05)
+    raise RuntimeError(f"server did not listen on port {port}")
+
+
+async def run_operation(
+    requests: List[Callable[[], Awaitable[Any]]], concurrency: int
+) -> Tuple[float, List[float]]:
+    # run requests with a fixed number of workers
+    # return wall time and latency of every request
+    queue: asyncio.Queue = asyncio.Queue()
+    for request in requests:
+        queue.put_nowait(request)
+    latencies: List[float] = []
+
+    async def worker():
+        while not queue.empty():
+            request = queue.get_nowait()
+            start = time.perf_counter()
+            resp = await request()
+            latencies.append(time.perf_counter() - start)
+            if resp.status_code >= 400:
+                raise RuntimeError(f"{resp.request.url}: {resp.status_code}")
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return time.perf_counter() - start, latencies
+
+
+async def run_worker(args: argparse.Namespace) -> Tuple[List[Result], Memory]:
+    # app must be imported inside the worker process, since storage
+    # folders are created from the worker environment at import time
+    from loguru import logger
+
+    if not args.verbose:
+        logger.remove()
+
+    from httpx import AsyncClient
+    from storage import storage
+
+    server = None
+    if args.uvicorn:
+        # serve from its own process, so encoding request bodies on the
+        # client side is not counted in server latency and memory
+        port = free_port()
+        command = [sys.executable, str(Path(__file__).resolve()), "--serve"]
+        command += ["--port", str(port)]
+        if args.verbose:
+            command.append("--verbose")
+        server = subprocess.Popen(command, cwd=Path(__file__).resolve().parent)
+        await wait_for_port(port, server)
+        client = AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=None)
+    else:
+        from app import APP
+
+        client = AsyncClient(app=APP, base_url="http://localhost", timeout=None)
+
+    # random non-zero payload, zero tail would be stripped as padding
+    rng = np.random.default_rng(0)
+    data = rng.integers(1, 256, size=args.size, dtype=np.uint8).tobytes()
+    prefix = settings.APP_PREFIX
+    transport = "uvicorn" if args.uvicorn else "asgi"
+
+    def upload(method: str, name: str) -> Callable[[], Awaitable[Any]]:
+        files = {"file": (name, data, "application/octet-stream")}
+        return lambda: client.request(method, f"{prefix}/file/", files=files)
+
+    def by_name(method: str, name: str) -> Callable[[], Awaitable[Any]]:
+        params = {"filename": name}
+        return lambda: client.request(method, f"{prefix}/file/", params=params)
+
+    async def fix(rounds: int) -> Tuple[float, List[float]]:
+        latencies: List[float] = []
+        for i in range(rounds):
+            # losing the disk is setup, only the rebuild is timed
+            block_id = i % settings.NUM_DISKS
+            shutil.rmtree(storage.block_path[block_id])
+            start = time.perf_counter()
+            resp = await client.post(f"{prefix}/fix/{block_id}")
+            latencies.append(time.perf_counter() - start)
+            if resp.status_code >= 400:
+                raise RuntimeError(f"{resp.request.url}: {resp.status_code}")
+        return sum(latencies), latencies
+
+    results: List[Result] = []
+    try:
+        async with client:
+            for concurrency in args.concurrency:
+                names = [f"bench-{concurrency}-{i}" for i in range(args.requests)]
+                plans: Dict[str, List[Callable[[], Awaitable[Any]]]] = {
+                    "create": [upload("POST", name) for name in names],
+                    "retrieve": [by_name("GET", name) for name in names],
+                    "update": [upload("PUT", name) for name in names],
+                    "delete": [by_name("DELETE", name) for name in names],
+                }
+
+                # other operations need the objects, upload them untimed
+                if "create" not in args.operations:
+                    await run_operation(plans["create"], concurrency)
+
+                for operation in OPERATIONS:
+                    if operation not in args.operations:
+                        continue
+
+                    # a rebuild covers the whole disk, so it runs one at a time,
+                    # once per worker, and its throughput counts every object
+                    if operation == "fix":
+                        if concurrency != args.concurrency[0]:
+                            continue
+                        elapsed, latencies = await fix(args.fix_rounds)
+                        volume = len(latencies) * len(names) * args.size
+                    else:
+                        elapsed, latencies = await run_operation(
+                            plans[operation], concurrency
+                        )
+                        volume = len(latencies) * args.size
+
+                    results.append(
+                        Result(
+                            transport=transport,
+                            disks=settings.NUM_DISKS,
+                            size=args.size,
+                            concurrency=1 if operation == "fix" else concurrency,
+                            operation=operation,
+                            ops=len(latencies),
+                            ops_per_sec=len(latencies) / elapsed,
+                            mb_per_sec=volume / elapsed / MB,
+                            p50_ms=float(np.percentile(latencies, 50)) * 1000,
+                            p99_ms=float(np.percentile(latencies, 99)) * 1000,
+                        )
+                    )
+
+                # clean up files left when delete is skipped
+                for path in storage.block_path:
+                    shutil.rmtree(path, ignore_errors=True)
+                    path.mkdir(parents=True, exist_ok=True)
+    finally:
+        # never leave the server process behind
+        if server is not None and server.poll() is None:
+            server.terminate()
+            server.wait()
+
+    # ru_maxrss is a high-water mark, so it is only meaningful per worker,
+    # the server is the only child so RUSAGE_CHILDREN is its peak
+    if server is not None:
+        rss = peak_rss_mb(resource.RUSAGE_CHILDREN)
+    else:
+        rss = peak_rss_mb()
+    memory = Memory(transport, settings.NUM_DISKS, args.size, rss)
+    return results, memory
+
+
+def spawn_worker(
+    args: argparse.Namespace, disks: int, size: int
+) -> Tuple[List[Result], Memory]:
+    # run one (NUM_DISKS, size) pair in a fresh process
+    with tempfile.TemporaryDirectory(prefix="benchmark-") as upload_path:
+        env = {
+            **os.environ,
+            "NUM_DISKS": str(disks),
+            "UPLOAD_PATH": upload_path,
+            "MAX_SIZE": str(max(size, settings.MAX_SIZE)),
+        }
+        command = [
+            sys.executable,
+            str(Path(__file__).resolve()),
+            "--worker",
+            "--size",
+            str(size),
+            "--concurrency",
+            ",".join(map(str, args.concurrency)),
+            "--requests",
+            str(args.requests),
+            "--fix-rounds",
+            str(args.fix_rounds),
+            "--operations",
+            ",".join(args.operations),
+        ]
+        if args.uvicorn:
+            command.append("--uvicorn")
+        if args.verbose:
+            command.append("--verbose")
+
+        proc = subprocess.run(
+            command,
+            cwd=Path(__file__).resolve().parent,
+            env=env,
+            stdout=subprocess.PIPE,
+            check=True,
+        )
+        rows = json.loads(proc.stdout)
+        return [Result(**row) for row in rows["results"]], Memory(**rows["memory"])
+
+
+def compare(
+    results: List[Result], baseline: List[Result], threshold: float
+) -> List[str]:
+    # flag results slower than baseline by more than threshold,
+    # and runs missing on either side so a different matrix does not pass
+    regressions: List[str] = []
+    reference = {result.key: result for result in baseline}
+    current = {result.key: result for result in results}
+    for key in reference.keys() - current.keys():
+        regressions.append(f"{'/'.join(map(str, key))}: missing from results")
+
+    for result in results:
+        name = "/".join(map(str, result.key))
+        base = reference.get(result.key)
+        if base is None:
+            regressions.append(f"{name}: missing from baseline")
+            continue
+
+        if result.ops_per_sec < base.ops_per_sec * (1 - threshold):
+            regressions.append(
+                f"{name}: ops/s {result.ops_per_sec:.1f} < {base.ops_per_sec:.1f}"
+            )
+        if result.p50_ms > base.p50_ms * (1 + threshold):
+            regressions.append(
+                f"{name}: p50 {result.p50_ms:.2f}ms > {base.p50_ms:.2f}ms"
+            )
+    return regressions
+
+
+def compare_memory(
+    memory: List[Memory], baseline: List[Memory], threshold: float
+) -> List[str]:
+    # flag workers using more peak RSS than baseline by more than threshold
+    regressions: List[str] = []
+    reference = {usage.key: usage for usage in baseline}
+    current = {usage.key: usage for usage in memory}
+    for key in reference.keys() - current.keys():
+        regressions.append(f"{'/'.join(map(str, key))}: missing from results")
+
+    for usage in memory:
+        name = "/".join(map(str, usage.key))
+        base = reference.get(usage.key)
+        if base is None:
+            regressions.append(f"{name}: missing from baseline")
+            continue
+
+        if usage.peak_rss_mb > base.peak_rss_mb * (1 + threshold):
+            regressions.append(
+                f"{name}: peak RSS {usage.peak_rss_mb:.1f}MB > {base.peak_rss_mb:.1f}MB"
+            )
+    return regressions
+
+
+def report(results: List[Result], memory: List[Memory]) -> None:
+    header = (
+        f"{'transport':<9} {'disks':>5} {'size':>10} {'conc':>4} {'op':<8} "
+        f"{'ops':>5} {'ops/s':>10} {'MB/s':>10} {'p50 ms':>10} {'p99 ms':>10}"
+    )
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        print(
+            f"{r.transport:<9} {r.disks:>5} {r.size:>10} {r.concurrency:>4} "
+            f"{r.operation:<8} {r.ops:>5} {r.ops_per_sec:>10.1f} "
+            f"{r.mb_per_sec:>10.2f} {r.p50_ms:>10.2f} {r.p99_ms:>10.2f}"
+        )
+
+    header = f"{'transport':<9} {'disks':>5} {'size':>10} {'peak rss MB':>12}"
+    print()
+    print(header)
+    print("-" * len(header))
+    for m in memory:
+        print(f"{m.transport:<9} {m.disks:>5} {m.size:>10} {m.peak_rss_mb:>12.1f}")
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark the storage API.")
+    parser.add_argument("--sizes", default="1K,64K,1M,16M", help="object sizes")
+    parser.add_argument("--size", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--concurrency", default="1,8", help="concurrency levels")
+    parser.add_argument("--disks", default="3,5", help="NUM_DISKS values")
+    parser.add_argument("--requests", type=int, default=16, help="requests per op")
+    parser.add_argument("--fix-rounds", type=int, default=3, help="rebuilds per run")
+    parser.add_argument(
+        "--operations", default=",".join(OPERATIONS), help="operations to run"
+    )
+    parser.add_argument("--uvicorn", action="store_true", help="serve over a socket")
+    parser.add_argument("--baseline", type=Path, help="baseline JSON to compare")
+    parser.add_argument("--save-baseline", type=Path, help="write results as baseline")
+    parser.add_argument(
+        "--threshold", type=float, default=0.2, help="allowed regression ratio"
+    )
+    parser.add_argument("--verbose", action="store_true", help="keep app logging")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+
+    args = parser.parse_args(argv)
+    args.sizes = parse_list(args.sizes, parse_size)
+    args.concurrency = parse_list(args.concurrency)
+    args.disks = parse_list(args.disks)
+    args.operations = [op for op in args.operations.split(",") if op]
+    unknown = set(args.operations) - set(OPERATIONS)
+    if unknown:
+        parser.error(f"unknown operations: {', '.join(sorted(unknown))}")
+    return args
+
+
+def serve(args: argparse.Namespace) -> None:
+    from loguru import logger
+
+    if not args.verbose:
+        logger.remove()
+
+    import uvicorn
+    from app import APP
+
+    uvicorn.run(APP, host="127.0.0.1", port=args.port, log_level="warning")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    if args.serve:
+        serve(args)
+        return 0
+    if args.worker:
+        results, memory = asyncio.run(run_worker(args))
+        rows = {
+            "results": [asdict(result) for result in results],
+            "memory": asdict(memory),
+        }
+        print(json.dumps(rows))
+        return 0
+
+    results: List[Result] = []
+    memory: List[Memory] = []
+    for disks in args.disks:
+        for size in args.sizes:
+            worker_results, worker_memory = spawn_worker(args, disks, size)
+            results.extend(worker_results)
+            memory.append(worker_memory)
+    report(results, memory)
+
+    # results only compare under the same sample counts
+    params = {"requests": args.requests, "fix_rounds": args.fix_rounds}
+    rows = {
+        "params": params,
+        "results": [asdict(result) for result in results],
+        "memory": [asdict(usage) for usage in memory],
+    }
+    if args.save_baseline:
+        args.save_baseline.write_text(json.dumps(rows, indent=2))
+
+    if args.baseline:
+        baseline = json.loads(args.baseline.read_text())
+        if baseline.get("params") != params:
+            print(f"REGRESSION run parameters {params} != {baseline.get('params')}")
+            return 1
+        regressions = compare(
+            results, [Result(**row) for row in baseline["results"]], args.threshold
+        ) + compare_memory(
+            memory, [Memory(**row) for row in baseline["memory"]], args.threshold
+        )
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -20,6 +20,7 @@ class Settings(BaseSettings):
     FOLDER_PREFIX: str = "block"
     NUM_DISKS: int = 5
     MAX_SIZE: int = 1024 * 1024 * 100  # 100MB
+    CHUNK_SIZE: int = 1024 * 1024  # 1MB, window size used to scan mapped blocks
 
 
 settings = Settings()
@@ -0,0 +1,70 @@
+from prometheus_client import Counter, Gauge, Histogram
+
+# latency buckets in seconds, from sub-millisecond disk windows
+# up to whole-store rebuilds
+BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    float("inf"),
+)
+
+"""HTTP metrics"""
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds",
+    "HTTP request latency by route.",
+    ("method", "route", "status"),
+    buckets=BUCKETS,
+)
+
+"""Disk metrics"""
+DISK_READ_BYTES = Counter("disk_read_bytes", "Bytes read from block disk.", ("disk",))
+DISK_WRITE_BYTES = Counter(
+    "disk_write_bytes", "Bytes written to block disk.", ("disk",)
+)
+DISK_READ_LATENCY = Histogram(
+    "disk_read_duration_seconds",
+    "Latency of reading one window of a block disk.",
+    ("disk",),
+    buckets=BUCKETS,
+)
+DISK_WRITE_LATENCY = Histogram(
+    "disk_write_duration_seconds",
+    "Latency of writing a block to block disk.",
+    ("disk",),
+    buckets=BUCKETS,
+)
+
+"""Storage stage metrics"""
+STAGE_LATENCY = Histogram(
+    "storage_stage_duration_seconds",
+    "Latency of storage stages such as parity encode/verify and checksum.",
+    ("stage",),
+    buckets=BUCKETS,
+)
+INTEGRITY_FAILURES = Counter(
+    "integrity_failures", "Files failing the integrity check, by reason.", ("reason",)
+)
+INTEGRITY_DELETIONS = Counter(
+    "integrity_deletions", "Damaged files deleted by the integrity check."
+)
+
+"""Rebuild metrics"""
+REBUILD_FILES = Gauge(
+    "rebuild_files", "Files to rebuild in the current fix run.", ("disk",)
+)
+REBUILD_FILES_DONE = Gauge(
+    "rebuild_files_done", "Files rebuilt so far in the current fix run.", ("disk",)
+)
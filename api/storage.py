@@ -1,14 +1,18 @@
 import base64
 import hashlib
+import os
 import sys
+from contextlib import ExitStack
 from pathlib import Path
-from typing import List, Tuple
+from typing import BinaryIO, Iterable, Iterator, List, Tuple
 
 import aiofiles
+import metrics
 import numpy as np
 import schemas
 from config import settings
 from fastapi import HTTPException, UploadFile
+from fastapi.concurrency import run_in_threadpool
 from loguru import logger
 
 
@@ -55,12 +59,14 @@ class Storage:
 
     async def __write_file(self, file: UploadFile) -> schemas.File:
         data = await file.read()
-        checksum = hashlib.md5(data).hexdigest()
+        with metrics.STAGE_LATENCY.labels(stage="checksum").time():
+            checksum = hashlib.md5(data).hexdigest()
         if len(data) > settings.MAX_SIZE:
             raise HTTPException(status_code=413, detail="File too large")
 
         # partition data to NUM_DISKS-1 blocks and a parity block
-        data_blocks, parity_block = await self.__partition_data(data)
+        with metrics.STAGE_LATENCY.labels(stage="parity_encode").time():
+            data_blocks, parity_block = await self.__partition_data(data)
 
         # write data to disk
         # the top NUM_DISKS-1 blocks are data blocks
@@ -68,14 +74,19 @@ class Storage:
         data_blocks.append(parity_block)
         for i in range(settings.NUM_DISKS):
             path = self.block_path[i] / file.filename
-            async with aiofiles.open(path, "wb") as fp:
-                await fp.write(data_blocks[i])
+            with metrics.DISK_WRITE_LATENCY.labels(disk=i).time():
+                async with aiofiles.open(path, "wb") as fp:
+                    await fp.write(data_blocks[i])
+            metrics.DISK_WRITE_BYTES.labels(disk=i).inc(len(data_blocks[i]))
+
+        with metrics.STAGE_LATENCY.labels(stage="base64").time():
+            content = base64.b64encode(data)
 
         return schemas.File(
             name=file.filename,
             size=len(data),
             checksum=checksum,
-            content=base64.b64encode(data),
+            content=content,
             content_type=file.content_type,
         )
 
@@ -85,16 +96,113 @@ class Storage:
             path = self.block_path[i] / filename
             path.unlink(missing_ok=missing_ok)
 
+    def __open_blocks(
+        self, stack: ExitStack, filename: str, disks: Iterable[int]
+    ) -> List[Tuple[int, BinaryIO]]:
+        # open blocks unbuffered, windows are read straight into our buffers
+        # reads are used instead of mmap, so a block truncated by a concurrent
+        # write shows up as a short read instead of SIGBUS
+        return [
+            (i, stack.enter_context(open(self.block_path[i] / filename, "rb", 0)))
+            for i in disks
+        ]
+
+    def __windows(self, length: int) -> Iterator[Tuple[int, int]]:
+        # split [0, length) into CHUNK_SIZE windows
+        for start in range(0, length, settings.CHUNK_SIZE):
+            yield start, min(start + settings.CHUNK_SIZE, length)
+
+    def __read_window(
+        self, disk: int, fp: BinaryIO, start: int, out: np.ndarray
+    ) -> np.ndarray:
+        # read block from start into out, return the part actually read
+        # which is shorter than out if the block ends early
+        with metrics.DISK_READ_LATENCY.labels(disk=disk).time():
+            fp.seek(start)
+            size = fp.readinto(memoryview(out)) or 0
+        metrics.DISK_READ_BYTES.labels(disk=disk).inc(size)
+        return out[:size]
+
+    def __xor_window(
+        self,
+        blocks: List[Tuple[int, BinaryIO]],
+        start: int,
+        end: int,
+        buffer: np.ndarray,
+        out: np.ndarray,
+    ) -> bool:
+        # xor the [start, end) window of all (disk, block) pairs into out
+        # blocks shorter than the window are treated as zero padded,
+        # return False if any block ended inside the window
+        out[:] = 0
+        complete = True
+        for disk, fp in blocks:
+            window = self.__read_window(disk, fp, start, buffer[: end - start])
+            out[: len(window)] ^= window
+            complete = complete and len(window) == end - start
+        return complete
+
     def __parity_verify(
-        self, data_blocks: List[np.ndarray], parity_block: np.ndarray
+        self,
+        data_blocks: List[Tuple[int, BinaryIO]],
+        parity: Tuple[int, BinaryIO],
+        length: int,
     ) -> bool:
-        # calculate parity block
-        verify_block = np.zeros((max(map(len, data_blocks)),), dtype=np.uint8)
-        for i in range(settings.NUM_DISKS - 1):
-            verify_block ^= data_blocks[i]
+        # calculate parity window by window and compare with the last block
+        parity_disk, parity_block = parity
+        buffer = np.empty((min(length, settings.CHUNK_SIZE),), dtype=np.uint8)
+        verify_block = np.empty_like(buffer)
+        for start, end in self.__windows(length):
+            verify_window = verify_block[: end - start]
+            if not self.__xor_window(data_blocks, start, end, buffer, verify_window):
+                return False
+            parity_window = self.__read_window(
+                parity_disk, parity_block, start, buffer[: end - start]
+            )
+            if not np.array_equal(parity_window, verify_window):
+                return False
+        return True
 
-        # check if parity block is equal to the last block
-        return np.array_equal(parity_block, verify_block)
+    def __verify_file(self, filename: str, length: int) -> bool:
+        with ExitStack() as stack:
+            blocks = self.__open_blocks(stack, filename, range(settings.NUM_DISKS))
+            return self.__parity_verify(blocks[:-1], blocks[-1], length)
+
+    def __trim_padding(
+        self, disk: int, fp: BinaryIO, length: int, buffer: np.ndarray
+    ) -> int:
+        # find the length of block without trailing zero padding
+        # scan windows from the end since padding is at most a few bytes
+        last = (length - 1) // settings.CHUNK_SIZE * settings.CHUNK_SIZE
+        for start in range(last, -1, -settings.CHUNK_SIZE):
+            end = min(start + settings.CHUNK_SIZE, length)
+            window = self.__read_window(disk, fp, start, buffer[: end - start])
+            nonzero = window != 0
+            if nonzero.any():
+                return start + len(window) - int(np.argmax(nonzero[::-1]))
+        return 0
+
+    def __read_file(self, filename: str) -> bytes:
+        with ExitStack() as stack:
+            blocks = self.__open_blocks(stack, filename, range(settings.NUM_DISKS - 1))
+
+            # strip the zero padding of every data block
+            buffer = np.empty((settings.CHUNK_SIZE,), dtype=np.uint8)
+            lengths = [
+                self.__trim_padding(disk, fp, os.fstat(fp.fileno()).st_size, buffer)
+                for disk, fp in blocks
+            ]
+
+            # read data blocks straight into the output
+            data = bytearray(sum(lengths))
+            offset = 0
+            for (disk, fp), length in zip(blocks, lengths):
+                out = np.frombuffer(data, dtype=np.uint8, count=length, offset=offset)
+                if len(self.__read_window(disk, fp, 0, out)) != length:
+                    logger.warning(f"Block truncated while reading: {filename}")
+                    raise HTTPException(status_code=404, detail="File not found")
+                offset += length
+            return bytes(data)
 
     def __file_exists(self, filename: str) -> bool:
         # only check if file exists on all blocks
@@ -119,23 +227,29 @@ class Storage:
         """
 
         # check if all data blocks and parity block exist
+        # a file missing on every block simply does not exist,
+        # only a partially missing file counts as damaged
         if not self.__file_exists(filename):
+            if any((block / filename).exists() for block in self.block_path):
+                metrics.INTEGRITY_FAILURES.labels(reason="missing_block").inc()
+                metrics.INTEGRITY_DELETIONS.inc()
             self.__delete_file(filename, missing_ok=True)
             return False
 
-        # read data from disk and store in data_blocks
-        data_blocks = []
-        for block in self.block_path:
-            async with aiofiles.open(block / filename, "rb") as fp:
-                data_blocks.append(np.frombuffer(await fp.read(), dtype=np.uint8))
-
         # check if size of all data blocks is equal
-        if not all(len(data_blocks[0]) == len(block) for block in data_blocks):
+        sizes = [(block / filename).stat().st_size for block in self.block_path]
+        if not all(sizes[0] == size for size in sizes):
+            metrics.INTEGRITY_FAILURES.labels(reason="size_mismatch").inc()
+            metrics.INTEGRITY_DELETIONS.inc()
             self.__delete_file(filename)
             return False
 
-        # check parity
-        if not self.__parity_verify(data_blocks[:-1], data_blocks[-1]):
+        # read blocks window by window off the event loop and check parity
+        with metrics.STAGE_LATENCY.labels(stage="parity_verify").time():
+            verified = await run_in_threadpool(self.__verify_file, filename, sizes[0])
+        if not verified:
+            metrics.INTEGRITY_FAILURES.labels(reason="parity_mismatch").inc()
+            metrics.INTEGRITY_DELETIONS.inc()
             self.__delete_file(filename)
             return False
 
@@ -155,14 +269,9 @@ class Storage:
             logger.warning(f"File not found: {filename}")
             raise HTTPException(status_code=404, detail="File not found")
 
-        # read data from disk
-        data_blocks = []
-        for i in range(settings.NUM_DISKS):
-            path = self.block_path[i] / filename
-            data_blocks.append(path.read_bytes().rstrip(b"\x00"))
-
-        # return data
-        return b"".join(data_blocks[:-1])
+        # read data blocks off the event loop
+        with metrics.STAGE_LATENCY.labels(stage="assemble").time():
+            return await run_in_threadpool(self.__read_file, filename)
 
     async def update_file(self, file: UploadFile) -> schemas.File:
         # check if file exists
@@ -185,25 +294,42 @@ class Storage:
         base_id = 0 if block_id != 0 else 1
         files = [file for file in self.block_path[base_id].iterdir() if file.is_file()]
 
+        # expose rebuild progress of this block
+        metrics.REBUILD_FILES.labels(disk=block_id).set(len(files))
+        metrics.REBUILD_FILES_DONE.labels(disk=block_id).set(0)
+
         # fix block by calculating parity block
         for file in files:
-            # read data from disk
-            data_blocks: List[np.ndarray] = []
-            for i in range(settings.NUM_DISKS):
-                if i != block_id:
-                    path = self.block_path[i] / file.name
-                    data_blocks.append(np.frombuffer(path.read_bytes(), dtype=np.uint8))
-
-            # use rest of block to calculate missing block
-            max_length = max(map(len, data_blocks))
-            fix_block = np.zeros((max_length,), dtype=np.uint8)
-            for block in data_blocks:
-                fix_block ^= block
-
-            # write the data back to missing block
-            path = self.block_path[block_id] / file.name
-            async with aiofiles.open(path, "wb") as fp:
-                await fp.write(fix_block)
+            with metrics.STAGE_LATENCY.labels(stage="parity_rebuild").time():
+                await run_in_threadpool(self.__rebuild_file, block_id, file.name)
+            metrics.REBUILD_FILES_DONE.labels(disk=block_id).inc()
+
+    def __rebuild_file(self, block_id: int, filename: str) -> None:
+        path = self.block_path[block_id] / filename
+
+        with ExitStack() as stack:
+            # open the rest of blocks from disk
+            data_blocks = self.__open_blocks(
+                stack, filename, (i for i in range(settings.NUM_DISKS) if i != block_id)
+            )
+            max_length = max(os.fstat(fp.fileno()).st_size for _, fp in data_blocks)
+
+            # empty file can not be mapped, just create it
+            if max_length == 0:
+                with metrics.DISK_WRITE_LATENCY.labels(disk=block_id).time():
+                    path.write_bytes(b"")
+                return
+
+            # use rest of block to calculate missing block window by window
+            # and write it through a preallocated output mapping
+            buffer = np.empty((min(max_length, settings.CHUNK_SIZE),), dtype=np.uint8)
+            fix_block = np.memmap(path, dtype=np.uint8, mode="w+", shape=(max_length,))
+            for start, end in self.__windows(max_length):
+                self.__xor_window(data_blocks, start, end, buffer, fix_block[start:end])
+            with metrics.DISK_WRITE_LATENCY.labels(disk=block_id).time():
+                fix_block.flush()
+            metrics.DISK_WRITE_BYTES.labels(disk=block_id).inc(max_length)
+            del fix_block
 
 
 storage: Storage = Storage(is_test="pytest" in sys.modules)
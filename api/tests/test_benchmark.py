@@ -0,0 +1,140 @@
+import json
+from pathlib import Path
+
+import pytest
+from benchmark import Memory, Result, compare, compare_memory, main, parse_size
+
+"""
+Test cases for benchmark regression gating
+@name benchmark
+"""
+
+
+def make_result(ops_per_sec: float = 100.0, p50_ms: float = 5.0, **kwargs) -> Result:
+    fields = dict(
+        transport="asgi",
+        disks=3,
+        size=1024,
+        concurrency=1,
+        operation="create",
+        ops=16,
+        ops_per_sec=ops_per_sec,
+        mb_per_sec=0.1,
+        p50_ms=p50_ms,
+        p99_ms=10.0,
+    )
+    fields.update(kwargs)
+    return Result(**fields)
+
+
+class TestParseSize:
+    @pytest.mark.parametrize(
+        "value, expected",
+        [
+            ("512", 512),
+            ("1K", 1024),
+            ("1k", 1024),
+            ("1.5M", 1024 * 1024 * 3 // 2),
+            (" 2G ", 2 * 1024 * 1024 * 1024),
+        ],
+    )
+    def test_parse_size(self, value: str, expected: int):
+        assert parse_size(value) == expected
+
+    def test_parse_size_invalid(self):
+        with pytest.raises(ValueError):
+            parse_size("1X")
+
+
+class TestCompare:
+    def test_compare_within_threshold(self):
+        baseline = [make_result()]
+        results = [make_result(ops_per_sec=85.0, p50_ms=5.5, p99_ms=50.0)]
+        assert compare(results, baseline, 0.2) == []
+
+    def test_compare_throughput_regression(self):
+        baseline = [make_result()]
+        regressions = compare([make_result(ops_per_sec=79.0)], baseline, 0.2)
+        assert len(regressions) == 1
+        assert "ops/s" in regressions[0]
+
+    def test_compare_latency_regression(self):
+        baseline = [make_result()]
+        regressions = compare([make_result(p50_ms=6.5)], baseline, 0.2)
+        assert len(regressions) == 1
+        assert "p50" in regressions[0]
+
+    def test_compare_matches_by_key(self):
+        # a slower operation is only compared against the same operation
+        baseline = [make_result(), make_result(operation="fix", ops_per_sec=10.0)]
+        results = [make_result(), make_result(operation="fix", ops_per_sec=9.0)]
+        assert compare(results, baseline, 0.2) == []
+
+    def test_compare_missing_baseline(self):
+        regressions = compare([make_result(ops_per_sec=1.0)], [], 0.2)
+        assert len(regressions) == 1
+        assert "missing from baseline" in regressions[0]
+
+    def test_compare_missing_results(self):
+        baseline = [make_result(), make_result(concurrency=8)]
+        regressions = compare([make_result()], baseline, 0.2)
+        assert len(regressions) == 1
+        assert "missing from results" in regressions[0]
+
+
+class TestCompareMemory:
+    def test_compare_memory_within_threshold(self):
+        baseline = [Memory("asgi", 3, 1024, 100.0)]
+        assert compare_memory([Memory("asgi", 3, 1024, 119.0)], baseline, 0.2) == []
+
+    def test_compare_memory_regression(self):
+        baseline = [Memory("asgi", 3, 1024, 100.0)]
+        regressions = compare_memory([Memory("asgi", 3, 1024, 121.0)], baseline, 0.2)
+        assert len(regressions) == 1
+        assert "peak RSS" in regressions[0]
+
+    def test_compare_memory_matches_by_key(self):
+        baseline = [Memory("asgi", 3, 1024, 100.0), Memory("asgi", 5, 1024, 200.0)]
+        memory = [Memory("asgi", 3, 1024, 100.0), Memory("asgi", 5, 1024, 150.0)]
+        assert compare_memory(memory, baseline, 0.2) == []
+
+    def test_compare_memory_missing(self):
+        baseline = [Memory("asgi", 3, 1024, 100.0)]
+        regressions = compare_memory([Memory("asgi", 5, 1024, 100.0)], baseline, 0.2)
+        assert len(regressions) == 2
+
+
+class TestMain:
+    def test_main_smoke(self, tmp_path: Path):
+        # run a real worker process without create, then gate against itself
+        baseline = tmp_path / "baseline.json"
+        argv = [
+            "--sizes",
+            "1K",
+            "--disks",
+            "3",
+            "--concurrency",
+            "1,2",
+            "--requests",
+            "1",
+            "--fix-rounds",
+            "1",
+            "--operations",
+            "retrieve,fix",
+        ]
+        assert main(argv + ["--save-baseline", str(baseline)]) == 0
+
+        rows = json.loads(baseline.read_text())
+        assert rows["params"] == {"requests": 1, "fix_rounds": 1}
+        assert [
+            (row["concurrency"], row["operation"], row["ops"])
+            for row in rows["results"]
+        ] == [(1, "retrieve", 1), (1, "fix", 1), (2, "retrieve", 1)]
+        assert all(row["disks"] == 3 and row["size"] == 1024 for row in rows["results"])
+        assert len(rows["memory"]) == 1
+        assert rows["memory"][0]["peak_rss_mb"] > 0
+
+        # a different sample count does not compare against the baseline
+        changed = argv[:]
+        changed[changed.index("--requests") + 1] = "2"
+        assert main(changed + ["--baseline", str(baseline)]) == 1
@@ -3,7 +3,9 @@ from typing import BinaryIO
 
 import pytest
 import schemas
+from config import settings
 from httpx import Response
+from storage import storage
 from tests import DEFAULT_FILE, RequestBody, ResponseBody, assert_request
 
 """
@@ -80,6 +82,49 @@ class TestRetrieveFile:
         resp = ResponseBody(status_code=404, body={"detail": "File not found"})
         await assert_request("get", req, resp)
 
+    @pytest.mark.usefixtures("create_file")
+    async def test_retrieve_file_corrupted_later_window(
+        self, monkeypatch: pytest.MonkeyPatch
+    ):
+        # shrink window and flip the last byte of a data block,
+        # so only the last window fails the parity verify
+        monkeypatch.setattr(settings, "CHUNK_SIZE", 2)
+        path = storage.block_path[0] / DEFAULT_FILE.name
+        data = bytearray(path.read_bytes())
+        assert len(data) > settings.CHUNK_SIZE
+        data[-1] ^= 0xFF
+        path.write_bytes(bytes(data))
+
+        req = RequestBody(
+            url="file:retrieve_file", body=None, params={"filename": DEFAULT_FILE.name}
+        )
+        resp = ResponseBody(status_code=404, body={"detail": "File not found"})
+        await assert_request("get", req, resp)
+        assert not path.exists()
+
+    @pytest.mark.usefixtures("create_file")
+    async def test_retrieve_file_truncated_during_verify(
+        self, monkeypatch: pytest.MonkeyPatch
+    ):
+        # truncate a block once verify has started reading windows,
+        # like a concurrent write reopening it with "wb"
+        monkeypatch.setattr(settings, "CHUNK_SIZE", 2)
+        path = storage.block_path[1] / DEFAULT_FILE.name
+        read_window = storage._Storage__read_window
+
+        def truncate_then_read(*args):
+            if path.exists():
+                path.write_bytes(b"")
+            return read_window(*args)
+
+        monkeypatch.setattr(storage, "_Storage__read_window", truncate_then_read)
+
+        req = RequestBody(
+            url="file:retrieve_file", body=None, params={"filename": DEFAULT_FILE.name}
+        )
+        resp = ResponseBody(status_code=404, body={"detail": "File not found"})
+        await assert_request("get", req, resp)
+
 
 """
 Test case for update file endpoint
@@ -27,3 +27,14 @@ class TestFixFile:
         await storage.fix_block(block_id)
         content = await storage.retrieve_file(DEFAULT_FILE.name)
         assert content.decode() == DEFAULT_FILE.content
+
+    @pytest.mark.usefixtures("create_file")
+    async def test_fix_file_multiple_windows(self, monkeypatch: pytest.MonkeyPatch):
+        # shrink window so the block is rebuilt across several windows
+        monkeypatch.setattr(settings, "CHUNK_SIZE", 2)
+        block_id = random.randint(0, settings.NUM_DISKS - 1)
+        shutil.rmtree(storage.block_path[block_id])
+
+        await storage.fix_block(block_id)
+        content = await storage.retrieve_file(DEFAULT_FILE.name)
+        assert content.decode() == DEFAULT_FILE.content
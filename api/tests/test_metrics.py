@@ -0,0 +1,95 @@
+from typing import List
+
+import pytest
+from app import APP
+from httpx import AsyncClient, Response
+from loguru import logger
+from storage import storage
+from tests import DEFAULT_FILE, RequestBody, ResponseBody, assert_request
+
+"""
+Test case for metrics endpoint
+@name metrics:get_metrics
+@router get /metrics
+@status_code 200
+@response_model str
+"""
+
+
+class TestGetMetrics:
+    def __assert_func(self, resp: Response, resp_body: ResponseBody):
+        assert resp.status_code == resp_body.status_code
+        assert resp.headers["content-type"].startswith("text/plain")
+        for line in resp_body.body:
+            assert line in resp.text
+
+    async def test_get_metrics_request_latency(self):
+        await assert_request(
+            "get",
+            RequestBody(url="health:get_health", body=None),
+            ResponseBody(status_code=200, body={"detail": "Service healthy"}),
+        )
+        req = RequestBody(url="metrics:get_metrics", body=None)
+        resp = ResponseBody(
+            status_code=200,
+            body=[
+                "# TYPE http_request_duration_seconds histogram",
+                'http_request_duration_seconds_count{method="GET",route="/api/health/",status="200"}',
+            ],
+        )
+        await assert_request("get", req, resp, self.__assert_func)
+
+    @pytest.mark.usefixtures("create_file")
+    async def test_get_metrics_storage_stages(self):
+        req = RequestBody(url="metrics:get_metrics", body=None)
+        resp = ResponseBody(
+            status_code=200,
+            body=[
+                'storage_stage_duration_seconds_count{stage="checksum"}',
+                'storage_stage_duration_seconds_count{stage="parity_encode"}',
+                'disk_write_bytes_total{disk="0"}',
+            ],
+        )
+        await assert_request("get", req, resp, self.__assert_func)
+
+    @pytest.mark.usefixtures("create_file")
+    async def test_get_metrics_integrity_failure(self):
+        # remove one block so the file is partially missing
+        (storage.block_path[0] / DEFAULT_FILE.name).unlink()
+        assert not await storage.file_integrity(DEFAULT_FILE.name)
+
+        req = RequestBody(url="metrics:get_metrics", body=None)
+        resp = ResponseBody(
+            status_code=200,
+            body=['integrity_failures_total{reason="missing_block"}'],
+        )
+        await assert_request("get", req, resp, self.__assert_func)
+
+    async def test_get_metrics_body_not_logged(self):
+        messages: List[str] = []
+        sink = logger.add(messages.append, level="INFO")
+        try:
+            req = RequestBody(url="metrics:get_metrics", body=None)
+            resp = ResponseBody(status_code=200, body=["# TYPE"])
+            await assert_request("get", req, resp, self.__assert_func)
+        finally:
+            logger.remove(sink)
+        assert not any("# TYPE" in message for message in messages)
+
+    @pytest.mark.usefixtures("create_file")
+    async def test_get_metrics_unhandled_error(self):
+        # fixing a block that does not exist raises inside the app
+        url = APP.url_path_for("fix:fix_block", block_id=99)
+        async with AsyncClient(app=APP, base_url="https://localhost") as ac:
+            with pytest.raises(IndexError):
+                await ac.post(url)
+
+        req = RequestBody(url="metrics:get_metrics", body=None)
+        resp = ResponseBody(
+            status_code=200,
+            body=[
+                'http_request_duration_seconds_count{method="POST",'
+                'route="/api/fix/{block_id}",status="500"}'
+            ],
+        )
+        await assert_request("get", req, resp, self.__assert_func)